@@ -1,8 +1,12 @@
 import streamlit as st
 import pandas as pd
 from datetime import date, timedelta
+from functools import lru_cache
 import random
+from collections import Counter
 import io
+import hashlib
+import inspect
 
 # ───────── Page Configuration ─────────
 st.set_page_config(page_title="📆 Spaced Daily Topic Review (Optimized)", layout="wide")
@@ -22,11 +26,12 @@ TOPICS = [
 START_DATE     = date(2025, 7, 21)
 END_DATE       = date(2025, 8, 31)
 TOPICS_PER_DAY = 5
+TOPIC_COLS     = tuple(f"Topic {i}" for i in range(1, TOPICS_PER_DAY+1))
 
-VACATION_DAYS = {
+VACATION_DAYS = frozenset({
     date(2025, 7, 11), date(2025, 7, 12),
     date(2025, 7, 13), date(2025, 7, 14),
-}
+})
 
 # ───────── Fixed‑day Overrides ─────────
 FIXED_DAYS = {
@@ -34,133 +39,166 @@ FIXED_DAYS = {
     date(2025, 7, 22): ["O chem 11-12", "Biochem 10/11"],
 }
 
-# ───────── Generate One Candidate Schedule ─────────
-def generate_schedule(topics, start_dt, end_dt, per_day, seed):
-    random.seed(seed)
-    total_days = (end_dt - start_dt).days + 1
-    last_seen = {t: start_dt - timedelta(days=total_days) for t in topics}
-    sched = []
-
-    for i in range(total_days):
+# ───────── Classify Calendar Days ─────────
+@lru_cache(maxsize=None)
+def day_plan(start_dt, end_dt, vacation_days):
+    # independent of the seed, so every trial shares one classification
+    plan = []
+    for i in range((end_dt - start_dt).days + 1):
         today = start_dt + timedelta(days=i)
 
         # skip vacation
-        if today in VACATION_DAYS:
-            sched.append({"Date": today, "Activity": "Vacation"})
-            continue
-
+        if today in vacation_days:
+            activity = "Vacation"
         # skip weekends
-        if today.weekday() >= 5:
-            sched.append({"Date": today, "Activity": "Weekend"})
-            continue
-
+        elif today.weekday() >= 5:
+            activity = "Weekend"
         # skip FL Practice Exam (Thursdays)
-        if today.weekday() == 3:
-            sched.append({"Date": today, "Activity": "FL Practice Exam"})
+        elif today.weekday() == 3:
+            activity = "FL Practice Exam"
+        else:
+            activity = None
+        plan.append((today, activity))
+    return tuple(plan)
+
+# ───────── Generate One Candidate Schedule ─────────
+def generate_schedule(topics, start_dt, end_dt, per_day, vacation_days, fixed_days, seed):
+    # day entries only have TOPIC_COLS slots to fill
+    if per_day > len(TOPIC_COLS):
+        raise ValueError(f"{per_day} topics per day exceeds {len(TOPIC_COLS)} slot columns")
+    random.seed(seed)
+    total_days = (end_dt - start_dt).days + 1
+    # day offsets from start_dt: int compares in the sort key, not dates
+    last_seen = {t: -total_days for t in topics}
+    # subject = topic name minus its chapter range; fixed per topic
+    subject = {t: " ".join(t.split()[:-1]) for t in topics}
+    sched = []
+
+    for day_idx, (today, activity) in enumerate(day_plan(start_dt, end_dt, vacation_days)):
+        if activity:
+            sched.append({"Date": today, "Activity": activity})
             continue
 
         # forced topics for today
-        fixed_today = FIXED_DAYS.get(today, [])
+        fixed_today = fixed_days.get(today, [])
         for t in fixed_today:
-            last_seen[t] = today
+            last_seen[t] = day_idx
 
         # select remaining slots
         slots = per_day - len(fixed_today)
-        pool = [t for t in topics if t not in fixed_today]
-        random.shuffle(pool)
-        pool.sort(key=lambda t: last_seen[t])
-
+        if slots < 0:
+            raise ValueError(
+                f"{today}: {len(fixed_today)} fixed topics exceed {per_day} per day"
+            )
         today_topics, seen_subj = [], set()
-        for topic in pool:
-            subj = " ".join(topic.split()[:-1])
-            if subj in seen_subj:
-                continue
-            today_topics.append(topic)
-            seen_subj.add(subj)
-            last_seen[topic] = today
-            if len(today_topics) == slots:
-                break
+
+        # overrides may fill the day; then skip the shuffle and pool scan
+        if slots > 0:
+            # most days have no overrides: copy the list instead of filtering it
+            pool = [t for t in topics if t not in fixed_today] if fixed_today else list(topics)
+            random.shuffle(pool)
+            pool.sort(key=last_seen.__getitem__)
+
+            for topic in pool:
+                subj = subject[topic]
+                if subj in seen_subj:
+                    continue
+                today_topics.append(topic)
+                seen_subj.add(subj)
+                last_seen[topic] = day_idx
+                if len(today_topics) == slots:
+                    break
 
         entry = {"Date": today}
-        for idx, t in enumerate(fixed_today + today_topics, 1):
-            entry[f"Topic {idx}"] = t
+        entry.update(zip(TOPIC_COLS, fixed_today + today_topics))
         sched.append(entry)
 
     return sched
 
+# ───────── Per-Topic Review Bookkeeping ─────────
+def topic_reviews(schedule):
+    # first/last day and review count per topic, from the day records
+    first, last, count = {}, {}, Counter()
+    for entry in schedule:
+        day = entry["Date"]
+        for key, t in entry.items():
+            if not key.startswith("Topic"):
+                continue
+            first.setdefault(t, day)
+            last[t] = day
+            count[t] += 1
+
+    # a topic's consecutive gaps sum to (last - first)
+    return {t: ((last[t] - first[t]).days, count[t]) for t in count}
+
 # ───────── Compute Average Gap ─────────
-def avg_spacing(schedule):
-    df = (
-        pd.DataFrame(schedule)
-          .melt(id_vars=["Date"],
-                value_vars=[f"Topic {i}" for i in range(1, TOPICS_PER_DAY+1)],
-                var_name="Slot", value_name="Topic")
-          .dropna(subset=["Topic"])
-    )
-    df["Date"] = pd.to_datetime(df["Date"])
-    gaps = []
-    for _, grp in df.groupby("Topic"):
-        days = grp["Date"].sort_values()
-        diffs = days.diff().dt.days.dropna()
-        gaps.extend(diffs.tolist())
-    return (sum(gaps)/len(gaps)) if gaps else float("inf")
+def spacing_stats(schedule):
+    reviews = topic_reviews(schedule).values()
+    n_gaps = sum(n - 1 for _, n in reviews)
+    gap_days = sum(g for g, _ in reviews)
+    avg = (gap_days/n_gaps) if n_gaps else float("inf")
+    return avg, min((n for _, n in reviews), default=0)
 
 # ───────── Optimization Trials ─────────
-trials = st.sidebar.number_input(
-    "Optimization trials", min_value=10, max_value=2000, value=200, step=10
-)
-best = {"avg": float("inf"), "min_reviews": -1, "sched": None}
-
-for seed in range(trials):
-    cand = generate_schedule(TOPICS, START_DATE, END_DATE, TOPICS_PER_DAY, seed)
-    a = avg_spacing(cand)
-
-    df_long = (
-        pd.DataFrame(cand)
-          .melt(id_vars=["Date"],
-                value_vars=[f"Topic {i}" for i in range(1, TOPICS_PER_DAY+1)],
-                var_name="Slot", value_name="Topic")
-          .dropna(subset=["Topic"])
+# the cache key covers optimize's own source only; hash the helpers it calls
+# so an edit to them can't keep serving a stale persisted schedule
+SCHEDULER_VERSION = hashlib.sha1("".join(
+    inspect.getsource(f) for f in (day_plan, generate_schedule, topic_reviews, spacing_stats)
+).encode()).hexdigest()
+
+# trials are deterministic per seed, so reruns with the same inputs hit the
+# cache; persisting to disk keeps it warm across server restarts
+@st.cache_data(persist="disk")
+def optimize(trials, topics, start_dt, end_dt, per_day, vacation_days, fixed_days,
+             scheduler_version):
+    best = {"avg": float("inf"), "min_reviews": -1, "sched": None}
+
+    for seed in range(trials):
+        cand = generate_schedule(
+            topics, start_dt, end_dt, per_day, vacation_days, fixed_days, seed
+        )
+        a, min_cnt = spacing_stats(cand)
+
+        if (a < best["avg"]) or (a == best["avg"] and min_cnt > best["min_reviews"]):
+            best.update(avg=a, min_reviews=min_cnt, sched=cand)
+
+    return best
+
+# a form so stepping the count doesn't launch a new search per click
+with st.sidebar.form("trials_form"):
+    trials = st.number_input(
+        "Optimization trials", min_value=10, max_value=2000, value=200, step=10
     )
-    counts = df_long["Topic"].value_counts()
-    min_cnt = counts.min()
-
-    if (a < best["avg"]) or (a == best["avg"] and min_cnt > best["min_reviews"]):
-        best.update(avg=a, min_reviews=min_cnt, sched=cand)
-
-# ───────── Compute Per-Topic Metrics ─────────
-metrics_long = (
-    pd.DataFrame(best["sched"])
-      .melt(id_vars=["Date"],
-            value_vars=[f"Topic {i}" for i in range(1, TOPICS_PER_DAY+1)],
-            var_name="Slot", value_name="Topic")
-      .dropna(subset=["Topic"])
+    st.form_submit_button("Optimize")
+best = optimize(
+    trials, TOPICS, START_DATE, END_DATE, TOPICS_PER_DAY, VACATION_DAYS, FIXED_DAYS,
+    SCHEDULER_VERSION,
 )
-metrics_long["Date"] = pd.to_datetime(metrics_long["Date"])
-
-metrics = []
-for topic, grp in metrics_long.groupby("Topic"):
-    dates = grp["Date"].sort_values()
-    gaps = dates.diff().dt.days.dropna()
-    avg_gap = gaps.mean() if not gaps.empty else 0
-    metrics.append({
-        "Topic": topic,
-        "Review Count": len(grp),
-        "Avg Gap (days)": round(avg_gap, 2)
-    })
 
-metrics_df = pd.DataFrame(metrics)
+# ───────── Compute Per-Topic Metrics ─────────
+# cached alongside the trials, so plain reruns skip rebuilding the table
+@st.cache_data
+def topic_metrics(schedule):
+    return pd.DataFrame([
+        {
+            "Topic": topic,
+            "Review Count": n,
+            "Avg Gap (days)": round(g/(n - 1), 2) if n > 1 else 0,
+        }
+        for topic, (g, n) in sorted(topic_reviews(schedule).items())
+    ])
+
+# rows come out sorted by topic
+metrics_df = topic_metrics(best["sched"])
 
 # ───────── Append Sept 2 Review of Least-Examined Topics ─────────
 least_count = metrics_df["Review Count"].min()
 least_topics = (
-    metrics_df[metrics_df["Review Count"] == least_count]
-    .sort_values("Topic")["Topic"]
+    metrics_df.loc[metrics_df["Review Count"] == least_count, "Topic"]
     .tolist()[:TOPICS_PER_DAY]
 )
 sep2_entry = {"Date": date(2025, 9, 2)}
-for idx, t in enumerate(least_topics, 1):
-    sep2_entry[f"Topic {idx}"] = t
+sep2_entry.update(zip(TOPIC_COLS, least_topics))
 full_sched = best["sched"] + [sep2_entry]
 
 # ───────── Display & Export ─────────
@@ -171,17 +209,24 @@ st.subheader(
 st.dataframe(df_full)
 
 st.subheader("Per-Topic Review Metrics")
-st.dataframe(metrics_df.sort_values("Topic").reset_index(drop=True))
-
-buf = io.BytesIO()
-with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-    df_full.to_excel(writer, sheet_name="Spaced Review")
-    metrics_df.to_excel(writer, sheet_name="Metrics", index=False)
-buf.seek(0)
-
-st.download_button(
-    label="📥 Export Schedule + Metrics",
-    data=buf,
-    file_name="optimized_spaced_review_with_sept2.xlsx",
-    mime="application/vnd.openxmlformats-officedocument-spreadsheetml.sheet"
-)
+st.dataframe(metrics_df)
+
+# clicking the download button reruns only this fragment, not the trials
+@st.fragment
+def export_button(df_full, metrics_df):
+    # only build the workbook when the user actually clicks download
+    def build_workbook():
+        buf = io.BytesIO()
+        with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+            df_full.to_excel(writer, sheet_name="Spaced Review")
+            metrics_df.to_excel(writer, sheet_name="Metrics", index=False)
+        return buf.getvalue()
+
+    st.download_button(
+        label="📥 Export Schedule + Metrics",
+        data=build_workbook,
+        file_name="optimized_spaced_review_with_sept2.xlsx",
+        mime="application/vnd.openxmlformats-officedocument-spreadsheetml.sheet"
+    )
+
+export_button(df_full, metrics_df)